@@ -1,16 +1,32 @@
 import os
 import sys
 import io
+import fnmatch
 import time
+import shutil
+import tarfile
+import tempfile
 import zipfile
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import List
 
 from dotenv import load_dotenv
 import dropbox
-from dropbox.files import WriteMode
+from dropbox.files import CommitInfo, UploadSessionCursor, WriteMode
+
+try:
+    import zstandard as zstd
+except Exception:  # pragma: no cover
+    zstd = None
+
+try:
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except Exception:  # pragma: no cover
+    pacsv = pq = None
 
 load_dotenv()
 
@@ -22,8 +38,22 @@ DROPBOX_DEST_FOLDER = os.getenv("DROPBOX_DEST_FOLDER", "/weekly_csv_backups")
 DROPBOX_ACCESS_TOKEN = os.getenv("DROPBOX_ACCESS_TOKEN", "")
 ZIP_NAME_PREFIX = os.getenv("ZIP_NAME_PREFIX", "csv_backup")
 RETAIN_DAYS = int(os.getenv("RETAIN_DAYS", "30"))
+# "tar.zst" (default) or "zip". zstd compresses CSV better than deflate and
+# uses all cores; set ARCHIVE_FORMAT=zip to keep the legacy artifact.
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "tar.zst").lower()
+# Convert CSVs to zstd-compressed Parquet before archiving: 3-5x smaller
+# uploads, and the archive step barely compresses since Parquet already is.
+CONVERT_TO_PARQUET = os.getenv("CONVERT_TO_PARQUET", "false").lower() == "true"
 DRY_RUN = os.getenv("DRY_RUN", "false").lower() == "true"
 
+# 4 MiB keeps the OpenSSL SHA-256 path (SHA-NI where available) fed without
+# bouncing back into Python for every small chunk.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Dropbox upload-session chunk. files_upload caps at 150 MiB and would force
+# reading the whole archive into memory; 8 MiB appends keep RSS flat.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
 # --- Helpers ---
 def log(msg: str):
     ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -35,52 +65,144 @@ def fail(msg: str, code: int = 1):
     sys.exit(code)
 
 
+def scan_tree(root: str, pattern: str, recursive: bool, cutoff: datetime):
+    # os.scandir hands back dirents with cached type/stat info, so each entry
+    # is statted exactly once (Path.glob stats once to list and we re-statted
+    # for the mtime — twice the metadata round-trips on network filesystems).
+    try:
+        it = os.scandir(root)
+    except OSError as e:
+        log(f"WARN: Skipping {root}: {e}")
+        return
+    with it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        yield from scan_tree(entry.path, pattern, recursive, cutoff)
+                elif entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
+                    mtime = datetime.fromtimestamp(entry.stat().st_mtime)
+                    if mtime >= cutoff:
+                        yield Path(entry.path)
+            except OSError as e:
+                log(f"WARN: Skipping {entry.path}: {e}")
+
+
 def find_files() -> List[Path]:
     if not SOURCE_DIRS:
         fail("No SOURCE_DIRS provided in .env")
     cutoff = datetime.now() - timedelta(days=LOOKBACK_DAYS)
+    parts = FILE_GLOB.split('/')
     files = []
     for root in SOURCE_DIRS:
         base = Path(root)
         if not base.exists():
             log(f"WARN: Source dir not found: {base}")
             continue
-        for p in base.glob(FILE_GLOB):
-            try:
-                if p.is_file():
-                    mtime = datetime.fromtimestamp(p.stat().st_mtime)
-                    if mtime >= cutoff:
-                        files.append(p)
-            except Exception as e:
-                log(f"WARN: Skipping {p}: {e}")
+        if parts[:-1] in ([], ['**']):
+            # Flat ("*.csv") or fully recursive ("**/*.csv") globs take the
+            # single-stat scandir walk
+            files.extend(scan_tree(str(base), parts[-1], parts[:-1] == ['**'], cutoff))
+        else:
+            # Globs with specific directory components keep the Path.glob path
+            for p in base.glob(FILE_GLOB):
+                try:
+                    if p.is_file():
+                        mtime = datetime.fromtimestamp(p.stat().st_mtime)
+                        if mtime >= cutoff:
+                            files.append(p)
+                except Exception as e:
+                    log(f"WARN: Skipping {p}: {e}")
     files.sort()
     return files
 
 
-def make_zip(files: List[Path]) -> Path:
+def sha256_file(path: Path) -> str:
+    with open(path, 'rb') as fh:
+        if hasattr(hashlib, 'file_digest'):  # Py 3.11+: C-level read loop, releases the GIL
+            return hashlib.file_digest(fh, 'sha256').hexdigest()
+        h = hashlib.sha256()
+        while chunk := fh.read(CHUNK_SIZE):
+            h.update(chunk)
+        return h.hexdigest()
+
+
+def convert_to_parquet(files: List[Path], tmp_dir: Path) -> List[Path]:
+    converted = []
+    for f in files:
+        tbl = pacsv.read_csv(f)
+        # strip the anchor (leading '/' or drive/UNC prefix) so the join
+        # can't escape tmp_dir on any platform
+        rel = f.with_suffix('.parquet')
+        dest = tmp_dir / (rel.relative_to(rel.anchor) if rel.anchor else rel)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(tbl, dest, compression='zstd', use_dictionary=True)
+        converted.append(dest)
+    return converted
+
+
+def make_archive(files: List[Path]) -> Path:
     if not files:
         fail("No CSV files found in lookback window; nothing to back up.", code=2)
+    if ARCHIVE_FORMAT not in ("tar.zst", "zip"):
+        fail(f"Unsupported ARCHIVE_FORMAT: {ARCHIVE_FORMAT} (use 'tar.zst' or 'zip')")
+    if ARCHIVE_FORMAT == "tar.zst" and zstd is None:
+        fail("zstandard is not installed; run 'pip install zstandard' or set ARCHIVE_FORMAT=zip")
+    if CONVERT_TO_PARQUET and pq is None:
+        fail("pyarrow is not installed; run 'pip install pyarrow' or unset CONVERT_TO_PARQUET")
     ts = datetime.now().strftime('%Y-%m-%d_%H%M%S')
-    zip_name = f"{ZIP_NAME_PREFIX}_{ts}.zip"
     out_dir = Path.cwd() / "out"
     out_dir.mkdir(parents=True, exist_ok=True)
-    zip_path = out_dir / zip_name
-
-    log(f"Creating archive: {zip_path}")
-    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-        manifest_lines = []
-        for f in files:
-            arcname = f.relative_to(Path(SOURCE_DIRS[0]).anchor if f.is_absolute() else Path.cwd())
-            zf.write(f, arcname=str(f))  # keep original relative tree for clarity
-            h = hashlib.sha256()
-            with open(f, 'rb') as fh:
-                for chunk in iter(lambda: fh.read(1024 * 1024), b''):
-                    h.update(chunk)
-            manifest_lines.append(f"{h.hexdigest()}  {f}")
-        # Add a manifest with hashes
-        manifest = "\n".join(manifest_lines) + "\n"
-        zf.writestr("MANIFEST.sha256", manifest)
-    return zip_path
+    archive_path = out_dir / f"{ZIP_NAME_PREFIX}_{ts}.{ARCHIVE_FORMAT}"
+
+    tmp_dir = None
+    if CONVERT_TO_PARQUET:
+        log(f"Converting {len(files)} CSVs to Parquet")
+        tmp_dir = Path(tempfile.mkdtemp(prefix="csv_backup_parquet_"))
+        files = convert_to_parquet(files, tmp_dir)
+
+    def arcname(f: Path) -> str:
+        # Mirror the original tree; converted Parquet files were written under
+        # tmp_dir along the same relative paths. For source files, drop the
+        # anchor ('/' or a Windows drive/UNC prefix) rather than just '/'.
+        if tmp_dir:
+            return str(f.relative_to(tmp_dir))
+        return str(f.relative_to(f.anchor)) if f.anchor else str(f)
+
+    try:
+        # Hash up front across all cores: sha256 releases the GIL, and SSDs are
+        # happy to serve concurrent reads. The archive loop below then only compresses.
+        log(f"Hashing {len(files)} files for the manifest")
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            digests = dict(zip(files, ex.map(sha256_file, files)))
+        manifest = "\n".join(f"{digests[f]}  {arcname(f)}" for f in files) + "\n"
+
+        log(f"Creating archive: {archive_path}")
+        if ARCHIVE_FORMAT == "zip":
+            # Parquet is already zstd-compressed; deflating it again just burns CPU.
+            compression = zipfile.ZIP_STORED if CONVERT_TO_PARQUET else zipfile.ZIP_DEFLATED
+            with zipfile.ZipFile(archive_path, 'w', compression=compression) as zf:
+                for f in files:
+                    zf.write(f, arcname=arcname(f))  # keep original relative tree for clarity
+                zf.writestr("MANIFEST.sha256", manifest)
+            return archive_path
+
+        # tar piped through zstd: level 3 with threads=-1 saturates all cores and
+        # beats single-threaded deflate on CSV for both speed and ratio.
+        cctx = zstd.ZstdCompressor(level=3, threads=-1)
+        with open(archive_path, 'wb') as raw, cctx.stream_writer(raw) as zs, \
+                tarfile.open(mode='w|', fileobj=zs) as tf:
+            for f in files:
+                tf.add(f, arcname=arcname(f))
+            data = manifest.encode()
+            ti = tarfile.TarInfo("MANIFEST.sha256")
+            ti.size = len(data)
+            ti.mtime = int(time.time())
+            tf.addfile(ti, io.BytesIO(data))
+        return archive_path
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
 def get_dbx() -> dropbox.Dropbox:
@@ -101,8 +223,20 @@ def upload_file(dbx: dropbox.Dropbox, local_path: Path, dest_folder: str) -> str
     if DRY_RUN:
         log("DRY_RUN=true → skipping upload")
         return dest_path
+    size = local_path.stat().st_size
     with open(local_path, 'rb') as f:
-        dbx.files_upload(f.read(), dest_path, mode=WriteMode.add)
+        if size <= UPLOAD_CHUNK_SIZE:
+            dbx.files_upload(f.read(), dest_path, mode=WriteMode.add)
+            return dest_path
+        # Chunked upload session: streams from disk in UPLOAD_CHUNK_SIZE
+        # pieces, so memory stays constant and there is no 150 MiB cap.
+        session = dbx.files_upload_session_start(f.read(UPLOAD_CHUNK_SIZE))
+        cursor = UploadSessionCursor(session_id=session.session_id, offset=f.tell())
+        commit = CommitInfo(path=dest_path, mode=WriteMode.add)
+        while (size - f.tell()) > UPLOAD_CHUNK_SIZE:
+            dbx.files_upload_session_append_v2(f.read(UPLOAD_CHUNK_SIZE), cursor)
+            cursor.offset = f.tell()
+        dbx.files_upload_session_finish(f.read(UPLOAD_CHUNK_SIZE), cursor, commit)
     return dest_path
 
 
@@ -112,7 +246,7 @@ def apply_retention(dbx: dropbox.Dropbox, dest_folder: str):
     cutoff = datetime.now() - timedelta(days=RETAIN_DAYS)
     log(f"Retention: deleting files in {dest_folder} older than {RETAIN_DAYS} days (before {cutoff.date()})")
     try:
-        res = dbx.files_list_folder(dest_folder)
+        res = dbx.files_list_folder(dest_folder, recursive=False, limit=2000)
     except dropbox.exceptions.ApiError as e:
         if isinstance(e.error, dropbox.files.ListFolderError):
             log(f"WARN: Destination folder may not exist yet: {dest_folder} ({e})")
@@ -123,14 +257,28 @@ def apply_retention(dbx: dropbox.Dropbox, dest_folder: str):
         res = dbx.files_list_folder_continue(res.cursor)
         entries.extend(res.entries)
 
+    to_delete = []
     for ent in entries:
-        if isinstance(ent, dropbox.files.FileMetadata) and ent.name.lower().endswith('.zip'):
+        if isinstance(ent, dropbox.files.FileMetadata) and ent.name.lower().endswith(('.zip', '.tar.zst')):
             # ent.server_modified is timezone-aware
             if ent.server_modified.replace(tzinfo=None) < cutoff:
-                path = ent.path_lower
-                log(f"Deleting old backup: {path}")
-                if not DRY_RUN:
-                    dbx.files_delete_v2(path)
+                log(f"Deleting old backup: {ent.path_lower}")
+                to_delete.append(dropbox.files.DeleteArg(ent.path_lower))
+
+    if not to_delete or DRY_RUN:
+        return
+    # One async batch job instead of one RPC per expired file.
+    launch = dbx.files_delete_batch(to_delete)
+    if launch.is_complete():
+        return
+    job_id = launch.get_async_job_id()
+    while True:
+        time.sleep(1)
+        check = dbx.files_delete_batch_check(job_id)
+        if not check.is_in_progress():
+            break
+    if check.is_failed():
+        log(f"WARN: Retention delete batch failed: {check.get_failed()}")
 
 
 def main():
@@ -138,9 +286,9 @@ def main():
     log(f"Sources: {SOURCE_DIRS} | glob={FILE_GLOB} | lookback={LOOKBACK_DAYS}d | dest={DROPBOX_DEST_FOLDER}")
     files = find_files()
     log(f"Discovered {len(files)} CSV files to back up")
-    zip_path = make_zip(files)
+    archive_path = make_archive(files)
     dbx = get_dbx()
-    dest = upload_file(dbx, zip_path, DROPBOX_DEST_FOLDER)
+    dest = upload_file(dbx, archive_path, DROPBOX_DEST_FOLDER)
     log(f"Uploaded: {dest}")
     apply_retention(dbx, DROPBOX_DEST_FOLDER)
     log("Backup completed successfully ✅")